@@ -1,5 +1,7 @@
 """APK building and signing for Android keyboard layouts."""
 
+import base64
+import functools
 import hashlib
 import io
 import os
@@ -10,7 +12,7 @@ from typing import Optional
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.hazmat.primitives.serialization import pkcs12, pkcs7
 from cryptography.x509.oid import NameOID
 
 RESOURCES_DIR = Path(__file__).parent.parent.parent / "resources"
@@ -19,6 +21,39 @@ RESOURCES_DIR = Path(__file__).parent.parent.parent / "resources"
 LAYOUT_PATH = "res/Q2.kcm"
 LAYOUT2_PATH = "res/_f.kcm"
 
+# Deflate level for entries compressed at build time. Everything we deflate is
+# small, so the fastest level costs almost nothing in APK size.
+DEFLATE_LEVEL = 1
+
+# Number of signed APKs kept in memory per builder, keyed by layout content
+BUILD_CACHE_SIZE = 256
+
+
+def _sha256_b64(data: bytes) -> str:
+    """SHA-256 digest of data, base64 encoded.
+
+    hashlib is backed by OpenSSL, which already uses SHA-NI / ARMv8 crypto
+    extensions where available and has less per-call overhead than
+    cryptography's Hash for the small entries found in an APK.
+    """
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+# Main attributes section of MANIFEST.MF; identical for every APK we sign
+_MANIFEST_MAIN = b"Manifest-Version: 1.0\r\nCreated-By: keylay\r\n\r\n"
+_MANIFEST_MAIN_DIGEST = _sha256_b64(_MANIFEST_MAIN)
+
+
+def _manifest_section(name: str, digest: str) -> bytes:
+    """A "Name" + "SHA-256-Digest" entry section, without its blank line."""
+    return b"".join(
+        [b"Name: ", name.encode("utf-8"), b"\r\nSHA-256-Digest: ", digest.encode("ascii"), b"\r\n"]
+    )
+
+
+# NoCapabilities removes SMIMECapabilities which Android doesn't support
+_PKCS7_OPTIONS = [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.NoCapabilities]
+
 
 class ApkSigner:
     """Signs APK/JAR files using v1 (JAR) signing scheme."""
@@ -44,127 +79,88 @@ class ApkSigner:
 
     def _hash_file(self, data: bytes) -> str:
         """SHA-256 hash of file contents, base64 encoded."""
-        import base64
-
-        digest = hashlib.sha256(data).digest()
-        return base64.b64encode(digest).decode("ascii")
-
-    def _create_manifest(self, files: dict[str, bytes]) -> bytes:
-        """Create MANIFEST.MF content."""
-        lines = [
-            "Manifest-Version: 1.0",
-            "Created-By: keylay",
-            "",
-        ]
-        for name, content in sorted(files.items()):
-            digest = self._hash_file(content)
-            lines.extend(
-                [
-                    f"Name: {name}",
-                    f"SHA-256-Digest: {digest}",
-                    "",
-                ]
-            )
-        return "\r\n".join(lines).encode("utf-8")
+        return _sha256_b64(data)
+
+    def _create_manifest(self, digests: dict[str, str]) -> bytes:
+        """Create MANIFEST.MF content from per-file digests."""
+        return _MANIFEST_MAIN + b"\r\n".join(
+            _manifest_section(name, digest) for name, digest in sorted(digests.items())
+        )
 
     def _hash_manifest_section(self, name: str, digest: str) -> str:
         """Hash a single manifest entry section."""
-        import base64
-
-        section = f"Name: {name}\r\nSHA-256-Digest: {digest}\r\n\r\n"
-        return base64.b64encode(hashlib.sha256(section.encode("utf-8")).digest()).decode("ascii")
+        return _sha256_b64(_manifest_section(name, digest) + b"\r\n")
 
     def _hash_manifest_main(self) -> str:
         """Hash the main attributes section of manifest."""
-        import base64
+        return _MANIFEST_MAIN_DIGEST
 
-        main = "Manifest-Version: 1.0\r\nCreated-By: keylay\r\n\r\n"
-        return base64.b64encode(hashlib.sha256(main.encode("utf-8")).digest()).decode("ascii")
-
-    def _create_signature_file(self, manifest: bytes, files: dict[str, bytes]) -> bytes:
+    def _create_signature_file(self, manifest: bytes, digests: dict[str, str]) -> bytes:
         """Create .SF signature file content."""
-        import base64
-
-        manifest_hash = base64.b64encode(hashlib.sha256(manifest).digest()).decode("ascii")
+        manifest_hash = _sha256_b64(manifest)
         main_hash = self._hash_manifest_main()
 
-        lines = [
-            "Signature-Version: 1.0",
-            "Created-By: keylay",
-            f"SHA-256-Digest-Manifest: {manifest_hash}",
-            f"SHA-256-Digest-Manifest-Main-Attributes: {main_hash}",
-            "",
-        ]
-
-        for name, content in sorted(files.items()):
-            file_digest = self._hash_file(content)
-            section_digest = self._hash_manifest_section(name, file_digest)
-            lines.extend(
-                [
-                    f"Name: {name}",
-                    f"SHA-256-Digest: {section_digest}",
-                    "",
-                ]
-            )
-
-        return "\r\n".join(lines).encode("utf-8")
+        header = (
+            "Signature-Version: 1.0\r\n"
+            "Created-By: keylay\r\n"
+            f"SHA-256-Digest-Manifest: {manifest_hash}\r\n"
+            f"SHA-256-Digest-Manifest-Main-Attributes: {main_hash}\r\n"
+            "\r\n"
+        )
+        return header.encode("ascii") + b"\r\n".join(
+            _manifest_section(name, self._hash_manifest_section(name, file_digest))
+            for name, file_digest in sorted(digests.items())
+        )
 
     def _create_pkcs7_signature(self, data: bytes) -> bytes:
         """Create PKCS#7 detached signature for APK v1 signing."""
-        from cryptography.hazmat.primitives.serialization import pkcs7
-
-        # NoCapabilities removes SMIMECapabilities which Android doesn't support
         signature = (
             pkcs7.PKCS7SignatureBuilder()
             .set_data(data)
             .add_signer(self.cert, self.private_key, hashes.SHA256())
-            .sign(
-                serialization.Encoding.DER,
-                [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.NoCapabilities],
-            )
+            .sign(serialization.Encoding.DER, _PKCS7_OPTIONS)
         )
         return signature
 
     def sign_apk(
-        self, input_zip: zipfile.ZipFile, output: io.BytesIO, replacements: dict[str, bytes]
+        self,
+        files: dict[str, bytes],
+        output: io.BytesIO,
+        infos: Optional[dict[str, zipfile.ZipInfo]] = None,
+        known_digests: Optional[dict[str, str]] = None,
     ):
         """
         Sign an APK with v1 (JAR) signing.
 
         Args:
-            input_zip: Source APK as ZipFile
+            files: Dict of path -> content for every file in the APK
             output: BytesIO to write signed APK to
-            replacements: Dict of path -> content for files to replace
+            infos: Optional dict of path -> source ZipInfo. Matching entries keep
+                their original compression method, timestamp and attributes, so
+                entries that were stored (e.g. resources.arsc) are not deflated.
+            known_digests: Optional dict of path -> SHA-256 digest (base64) for
+                entries whose content is unchanged. Other entries are hashed.
         """
-        files: dict[str, bytes] = {}
+        if infos is None:
+            infos = {}
+        if known_digests is None:
+            known_digests = {}
 
-        # Collect all files, applying replacements
-        for info in input_zip.infolist():
-            if info.is_dir():
-                continue
-            name = info.filename
-            # Skip existing signature files
-            if name.startswith("META-INF/") and (
-                name.endswith(".SF")
-                or name.endswith(".RSA")
-                or name.endswith(".DSA")
-                or name.endswith(".EC")
-                or name == "META-INF/MANIFEST.MF"
-            ):
-                continue
-
-            if name in replacements:
-                files[name] = replacements[name]
-            else:
-                files[name] = input_zip.read(name)
+        # Hash each file once; both the manifest and .SF need the digests
+        digests = {
+            name: known_digests.get(name) or self._hash_file(content)
+            for name, content in files.items()
+        }
 
         # Create signature files
-        manifest = self._create_manifest(files)
-        sig_file = self._create_signature_file(manifest, files)
+        manifest = self._create_manifest(digests)
+        sig_file = self._create_signature_file(manifest, digests)
         pkcs7_sig = self._create_pkcs7_signature(sig_file)
 
         # Write signed APK
-        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        with zipfile.ZipFile(
+            output, "w", zipfile.ZIP_DEFLATED, compresslevel=DEFLATE_LEVEL
+        ) as out_zip:
             # Write manifest and signatures first
             out_zip.writestr("META-INF/MANIFEST.MF", manifest)
             out_zip.writestr("META-INF/KEYLAY.SF", sig_file)
@@ -172,44 +168,123 @@ class ApkSigner:
 
             # Write all other files
             for name, content in files.items():
-                out_zip.writestr(name, content)
+                if name in infos:
+                    out_zip.writestr(_entry_info(infos[name]), content, compresslevel=DEFLATE_LEVEL)
+                else:
+                    out_zip.writestr(name, content)
+
+
+def _is_signature_file(name: str) -> bool:
+    """Whether a ZIP entry is part of an existing JAR signature."""
+    return name.startswith("META-INF/") and (
+        name.endswith(".SF")
+        or name.endswith(".RSA")
+        or name.endswith(".DSA")
+        or name.endswith(".EC")
+        or name == "META-INF/MANIFEST.MF"
+    )
+
+
+class ApkTemplate:
+    """An unsigned APK template, parsed into memory once."""
+
+    def __init__(self, files: dict[str, bytes], infos: dict[str, zipfile.ZipInfo]):
+        self.files = files
+        self.infos = infos
+        # Template entries never change, so their manifest digests are reused
+        self.digests = {name: _sha256_b64(content) for name, content in files.items()}
+
+    @classmethod
+    def load(cls, path: Path):
+        """
+        Read an APK template from disk.
+
+        Entries are decompressed once so that builds don't need to re-parse the
+        ZIP. Directories and existing signature files are skipped.
+        """
+        files: dict[str, bytes] = {}
+        infos: dict[str, zipfile.ZipInfo] = {}
+        with zipfile.ZipFile(path, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir() or _is_signature_file(info.filename):
+                    continue
+                files[info.filename] = zf.read(info)
+                infos[info.filename] = info
+        return cls(files, infos)
+
+
+def _entry_info(source: zipfile.ZipInfo) -> zipfile.ZipInfo:
+    """Fresh ZipInfo carrying over a template entry's metadata.
+
+    ZipFile.writestr mutates the ZipInfo it is given, so the template's own
+    objects must never be passed to it directly.
+    """
+    info = zipfile.ZipInfo(source.filename, date_time=source.date_time)
+    info.compress_type = source.compress_type
+    info.external_attr = source.external_attr
+    return info
+
+
+def _layout_bytes(layout: str | bytes) -> bytes:
+    """KCM content as bytes for writing into the APK."""
+    if isinstance(layout, bytes):
+        return layout
+    return layout.encode("utf-8")
 
 
 class ApkBuilder:
     """Builds keyboard layout APKs."""
 
-    def __init__(self, signer: ApkSigner):
+    def __init__(self, signer: ApkSigner, cache_size: int = BUILD_CACHE_SIZE):
         self.signer = signer
-        self._one_layout_apk: Optional[bytes] = None
-        self._two_layout_apk: Optional[bytes] = None
+        self._one_layout_template: Optional[ApkTemplate] = None
+        self._two_layout_template: Optional[ApkTemplate] = None
+        # Many users submit the same layouts, so signed APKs are cached by content
+        self._build_cached = functools.lru_cache(maxsize=cache_size)(self._build)
 
     def init(self):
-        """Load APK templates."""
-        self._one_layout_apk = (RESOURCES_DIR / "app-oneLayout-release-unsigned.apk").read_bytes()
-        self._two_layout_apk = (RESOURCES_DIR / "app-twoLayouts-release-unsigned.apk").read_bytes()
+        """Load and parse APK templates."""
+        self._one_layout_template = ApkTemplate.load(
+            RESOURCES_DIR / "app-oneLayout-release-unsigned.apk"
+        )
+        self._two_layout_template = ApkTemplate.load(
+            RESOURCES_DIR / "app-twoLayouts-release-unsigned.apk"
+        )
+        self._build_cached.cache_clear()
 
-    def build_apk(self, layout: str, layout2: Optional[str] = None) -> bytes:
+    def build_apk(self, layout: str | bytes, layout2: Optional[str | bytes] = None) -> bytes:
         """
         Build a signed APK with the given keyboard layout(s).
 
         Args:
-            layout: Primary keyboard layout content (KCM format)
+            layout: Primary keyboard layout content (KCM format). Bytes are
+                used as-is; text is encoded as UTF-8.
             layout2: Optional secondary layout content
 
         Returns:
             Signed APK bytes
         """
-        if self._one_layout_apk is None:
+        return self._build_cached(
+            _layout_bytes(layout), _layout_bytes(layout2) if layout2 else None
+        )
+
+    def _build(self, layout: bytes, layout2: Optional[bytes]) -> bytes:
+        """Build and sign an APK; cached by build_apk."""
+        if self._one_layout_template is None:
             self.init()
 
-        template = self._two_layout_apk if layout2 else self._one_layout_apk
-        replacements = {LAYOUT_PATH: layout.encode("utf-8")}
+        template = self._two_layout_template if layout2 else self._one_layout_template
+        replacements = {LAYOUT_PATH: layout}
         if layout2:
-            replacements[LAYOUT2_PATH] = layout2.encode("utf-8")
+            replacements[LAYOUT2_PATH] = layout2
+
+        # Only the replaced layouts need hashing at build time
+        digests = {
+            name: digest for name, digest in template.digests.items() if name not in replacements
+        }
 
         output = io.BytesIO()
-        with zipfile.ZipFile(io.BytesIO(template), "r") as in_zip:
-            self.signer.sign_apk(in_zip, output, replacements)
+        self.signer.sign_apk({**template.files, **replacements}, output, template.infos, digests)
 
         return output.getvalue()
 
@@ -33,8 +33,8 @@ def main():
         from pathlib import Path
         from .apk_builder import create_builder_from_env
 
-        layout = Path(args.layout).read_text()
-        layout2 = Path(args.layout2).read_text() if args.layout2 else None
+        layout = Path(args.layout).read_bytes()
+        layout2 = Path(args.layout2).read_bytes() if args.layout2 else None
 
         builder = create_builder_from_env()
         apk_bytes = builder.build_apk(layout, layout2)
@@ -1,11 +1,21 @@
 """Keyboard layout processing for Android KCM files."""
 
+import functools
+import re
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 DEFAULT_LAYOUT = "type OVERLAY\n"
 MODIFICATIONS_COMMENT = "# Custom key mappings:\n"
 
+# Allowed layout file names: a plain .kcm file name, no directories
+_KCM_NAME_RE = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]*\.kcm")
+
+# map key [usage] <code> <keyCode>, one per line
+_MAP_KEY_RE = re.compile(
+    r"^[ \t]*map[ \t]+key[ \t]+(usage[ \t]+)?(\S+)[ \t]+(\S+)[ \t\r]*$", re.MULTILINE
+)
+
 # Resource directory for KCM files
 RESOURCES_DIR = Path(__file__).parent.parent.parent / "resources"
 
@@ -14,20 +24,33 @@ def get_kcm_path(name: str) -> Path:
     """Get the path to a KCM file by name.
 
     Raises:
-        ValueError: If name contains path traversal characters.
+        ValueError: If name is not a plain .kcm file name.
     """
-    if "/" in name or "\\" in name or ".." in name:
+    if not _KCM_NAME_RE.fullmatch(name):
         raise ValueError("Invalid layout name")
     return RESOURCES_DIR / "kcm" / name
 
 
 def read_layout(name: str) -> Optional[str]:
-    """Read a named layout from the kcm resources directory."""
+    """Read a named layout from the kcm resources directory.
+
+    Contents are cached, as the server reads the same few base layouts for
+    every request. The file's mtime is part of the cache key, so edited
+    layouts are picked up.
+    """
     if not name:
         return None
     path = get_kcm_path(name)
-    if not path.exists():
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
         return None
+    return _read_kcm(path, mtime_ns)
+
+
+@functools.lru_cache(maxsize=64)
+def _read_kcm(path: Path, mtime_ns: int) -> str:
+    """Read a KCM file; mtime_ns only serves as part of the cache key."""
     # Try UTF-8 first, fall back to Latin-1 for older KCM files
     try:
         return path.read_text(encoding="utf-8")
@@ -40,26 +63,40 @@ def parse_map_key(line: str) -> Optional[tuple[bool, str, str]]:
     Parse a 'map key' line from a KCM file.
 
     Returns (is_usage, code, keyCode) or None if not a valid map key line.
+    Uses the same matching as from_layout applies to each line of a layout.
     """
-    trimmed = line.strip()
-    if not trimmed.startswith("map "):
+    match = _MAP_KEY_RE.fullmatch(line.removesuffix("\n"))
+    if not match:
         return None
+    return _map_key_match(match)
 
-    parts = line.split()
-    if len(parts) < 4:
-        return None
 
-    if parts[1] != "key":
+def _map_key_match(match: re.Match) -> Optional[tuple[bool, str, str]]:
+    """Convert a _MAP_KEY_RE match to (is_usage, code, keyCode)."""
+    is_usage = match.group(1) is not None
+    code = match.group(2)
+    if not is_usage and code == "usage":
+        # "map key usage X" is missing either the usage code or the keyCode
         return None
+    return (is_usage, code, match.group(3))
+
 
-    if parts[2] == "usage":
-        if len(parts) != 5:
-            return None
-        return (True, parts[3], parts[4])
-    else:
-        if len(parts) != 4:
-            return None
-        return (False, parts[2], parts[3])
+def _find_map_keys(layout: str) -> Iterator[re.Match]:
+    """Yield _MAP_KEY_RE matches for the mapping lines of a layout.
+
+    str.find jumps straight to candidate lines, which is much faster than
+    letting the regex try every position of the text.
+    """
+    pos = 0
+    while (index := layout.find("map", pos)) != -1:
+        line_start = layout.rfind("\n", 0, index) + 1
+        line_end = layout.find("\n", index)
+        if line_end == -1:
+            line_end = len(layout)
+        match = _MAP_KEY_RE.match(layout, line_start, line_end)
+        if match:
+            yield match
+        pos = line_end
 
 
 def from_layout(layout: str, mappings: dict[str, str]) -> str:
@@ -77,41 +114,47 @@ def from_layout(layout: str, mappings: dict[str, str]) -> str:
         return layout
 
     result = []
-    remaining_mappings = dict(mappings)
-
-    if "map " not in layout:
-        # No existing mappings, just append ours
-        result.append(layout)
-    else:
-        # Process each line, potentially commenting out conflicting mappings
-        for line in layout.splitlines():
-            parsed = parse_map_key(line)
-            if parsed:
-                is_usage, code, key_code = parsed
-                full_code = f"usage {code}" if is_usage else code
-
-                if full_code in remaining_mappings:
-                    user_key_code = remaining_mappings[full_code]
-                    if user_key_code == key_code:
-                        # Same mapping, remove from user mappings
-                        del remaining_mappings[full_code]
-                    else:
-                        # Different mapping, comment out the original
-                        result.append(MODIFICATIONS_COMMENT)
-                        result.append(f"# {line}")
-                        continue
-
-            result.append(line)
-        result.append("")  # Ensure trailing newline
+    # Codes whose requested mapping is already present in the layout
+    already_mapped = set()
+
+    # Visit only the mapping lines, copying the text between them and
+    # commenting out conflicting mappings
+    pos = 0
+    for match in _find_map_keys(layout):
+        parsed = _map_key_match(match)
+        if not parsed:
+            continue
+        is_usage, code, key_code = parsed
+        full_code = f"usage {code}" if is_usage else code
+
+        user_key_code = mappings.get(full_code)
+        if user_key_code == key_code:
+            # Same mapping, no need to add it again
+            already_mapped.add(full_code)
+        elif user_key_code is not None:
+            # Different mapping, comment out the original
+            line_start = match.start()
+            result.append(layout[pos:line_start])
+            result.append(MODIFICATIONS_COMMENT)
+            result.append("# ")
+            pos = line_start
+    result.append(layout[pos:])
+
+    # Ensure trailing newline
+    if layout and not layout.endswith(("\n", "\r")):
+        result.append("\n")
 
     # Add remaining user mappings
+    remaining_mappings = {
+        code: key_code for code, key_code in mappings.items() if code not in already_mapped
+    }
     if remaining_mappings:
-        result.append("")
-        result.append(MODIFICATIONS_COMMENT.rstrip())
+        result.append("\n")
+        result.append(MODIFICATIONS_COMMENT)
         for code, key_code in remaining_mappings.items():
-            result.append(f"map key {code} {key_code}")
+            result.append(f"map key {code} {key_code}\n")
 
-    return "\n".join(result)
+    return "".join(result)
 
 
 def from_named_layout(base_layout_name: Optional[str], mappings: dict[str, str]) -> str:
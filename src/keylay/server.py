@@ -4,7 +4,7 @@ import logging
 import os
 from pathlib import Path
 
-from flask import Flask, redirect, request, send_file, send_from_directory
+from flask import Flask, Response, redirect, request, send_from_directory
 
 from .apk_builder import ApkBuilder, create_builder_from_env
 from .layouts import from_named_layout
@@ -17,15 +17,25 @@ PUBLIC_DIR = RESOURCES_DIR / "public"
 # Maximum layout content size (64KB should be plenty for any KCM file)
 MAX_LAYOUT_SIZE = 64 * 1024
 
+# Security headers added to every response
+SECURITY_HEADERS = {
+    "X-Frame-Options": "DENY",
+    "X-Content-Type-Options": "nosniff",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+}
 
-def create_app(builder: ApkBuilder | None = None) -> Flask:
+
+def create_app(builder: ApkBuilder | None = None, testing: bool = False) -> Flask:
     """Create and configure the Flask application."""
     app = Flask(__name__)
+    app.config["TESTING"] = testing
 
     # Secret key for CSRF protection (generate random if not set)
-    app.config["SECRET_KEY"] = os.environ.get(
-        "FLASK_SECRET_KEY", os.urandom(32).hex()
-    )
+    secret_key = os.environ.get("FLASK_SECRET_KEY")
+    if not secret_key:
+        logger.warning("FLASK_SECRET_KEY not set; using a random key for this process")
+        secret_key = os.urandom(32).hex()
+    app.config["SECRET_KEY"] = secret_key
 
     if builder is None:
         builder = create_builder_from_env()
@@ -33,9 +43,7 @@ def create_app(builder: ApkBuilder | None = None) -> Flask:
     @app.after_request
     def add_security_headers(response):
         """Add security headers to all responses."""
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        response.headers.update(SECURITY_HEADERS)
         return response
 
     @app.before_request
@@ -89,14 +97,12 @@ def create_app(builder: ApkBuilder | None = None) -> Flask:
         layout_name = request.form.get("layout")
         layout2_name = request.form.get("layout2")
 
-        # Collect key mappings from form
-        mappings = {}
-        for key, value in request.form.items():
-            if key.startswith("from") and value:
-                idx = key[4:]  # Get the number suffix
-                to_key = request.form.get(f"to{idx}")
-                if to_key:
-                    mappings[value] = to_key
+        # Collect key mappings from form, skipping pairs with an empty side
+        mappings = {
+            value: to_key
+            for key, value in request.form.items()
+            if key.startswith("from") and value and (to_key := request.form.get(f"to{key[4:]}"))
+        }
 
         # Generate layouts
         layout = from_named_layout(layout_name, mappings)
@@ -132,13 +138,10 @@ def create_app(builder: ApkBuilder | None = None) -> Flask:
             logger.exception("Error building APK")
             return str(e), 500
 
-        import io
-
-        return send_file(
-            io.BytesIO(apk_bytes),
+        return Response(
+            apk_bytes,
             mimetype="application/vnd.android.package-archive",
-            as_attachment=True,
-            download_name="KeyboardLayout.apk",
+            headers={"Content-Disposition": 'attachment; filename="KeyboardLayout.apk"'},
         )
 
     return app
@@ -48,6 +48,53 @@ class TestApkBuilder:
             assert "CTRL_LEFT" in kcm1
             assert "ESC" in kcm2
 
+    def test_build_from_bytes(self, builder):
+        """Layout content given as bytes is written unchanged."""
+        layout = b"type OVERLAY\nmap key 58 CTRL_LEFT\n"
+        apk_bytes = builder.build_apk(layout)
+
+        with zipfile.ZipFile(io.BytesIO(apk_bytes)) as zf:
+            assert zf.read("res/Q2.kcm") == layout
+
+    def test_identical_layouts_are_cached(self, builder):
+        layout = "type OVERLAY\nmap key 58 ESCAPE\n"
+        first = builder.build_apk(layout)
+        assert builder.build_apk(layout.encode("utf-8")) is first
+        assert builder.build_apk(layout, layout) is not first
+
+    def test_template_entries_preserved(self, builder):
+        """Every non-signature entry of the template ends up in the APK."""
+        layout = "type OVERLAY\n"
+        apk_bytes = builder.build_apk(layout)
+
+        with zipfile.ZipFile(io.BytesIO(apk_bytes)) as zf:
+            names = zf.namelist()
+            for name in builder._one_layout_template.files:
+                assert name in names
+            # Signature files are written exactly once
+            assert names.count("META-INF/MANIFEST.MF") == 1
+
+    def test_template_compression_preserved(self, builder):
+        """Stored template entries (e.g. resources.arsc) must stay stored."""
+        layout = "type OVERLAY\n"
+        apk_bytes = builder.build_apk(layout)
+
+        template = builder._one_layout_template
+        with zipfile.ZipFile(io.BytesIO(apk_bytes)) as zf:
+            for name, source in template.infos.items():
+                info = zf.getinfo(name)
+                assert info.compress_type == source.compress_type
+                assert info.date_time == source.date_time
+
+    def test_layouts_are_stored_uncompressed(self, builder):
+        """Layouts inherit the template's stored ZipInfo, so they aren't deflated."""
+        layout = "type OVERLAY\nmap key 58 CTRL_LEFT\n"
+        apk_bytes = builder.build_apk(layout, layout)
+
+        with zipfile.ZipFile(io.BytesIO(apk_bytes)) as zf:
+            assert zf.getinfo("res/Q2.kcm").compress_type == zipfile.ZIP_STORED
+            assert zf.getinfo("res/_f.kcm").compress_type == zipfile.ZIP_STORED
+
 
 class TestApkSigner:
     def test_manifest_creation(self, builder):
@@ -60,6 +107,25 @@ class TestApkSigner:
             assert "Manifest-Version: 1.0" in manifest
             assert "SHA-256-Digest:" in manifest
 
+    def test_manifest_digests_match_contents(self, builder):
+        """Test that each manifest digest is the SHA-256 of the entry."""
+        import base64
+        import hashlib
+
+        layout = "type OVERLAY\nmap key 58 ESCAPE\n"
+        apk_bytes = builder.build_apk(layout)
+
+        with zipfile.ZipFile(io.BytesIO(apk_bytes)) as zf:
+            manifest = zf.read("META-INF/MANIFEST.MF").decode("utf-8")
+            sections = manifest.strip().split("\r\n\r\n")[1:]
+            assert len(sections) == len(zf.namelist()) - 3
+            for section in sections:
+                name_line, digest_line = section.split("\r\n")
+                name = name_line.removeprefix("Name: ")
+                digest = digest_line.removeprefix("SHA-256-Digest: ")
+                expected = base64.b64encode(hashlib.sha256(zf.read(name)).digest())
+                assert digest == expected.decode("ascii")
+
     def test_signature_file_creation(self, builder):
         """Test that signature file is properly formatted."""
         layout = "type OVERLAY\n"
@@ -116,5 +182,6 @@ class TestApkSigner:
 
             # SMIMECapabilities must NOT be present: 1.2.840.113549.1.9.15
             smime_capabilities_oid = bytes([0x2A, 0x86, 0x48, 0x86, 0xF7, 0x0D, 0x01, 0x09, 0x0F])
-            assert smime_capabilities_oid not in rsa_bytes, \
-                "SMIMECapabilities breaks Android APK verification"
+            assert (
+                smime_capabilities_oid not in rsa_bytes
+            ), "SMIMECapabilities breaks Android APK verification"
@@ -1,5 +1,7 @@
 """Tests for layout processing."""
 
+import os
+
 import pytest
 
 from keylay.layouts import (
@@ -9,6 +11,7 @@ from keylay.layouts import (
     from_named_layout,
     get_kcm_path,
     parse_map_key,
+    read_layout,
 )
 
 
@@ -29,6 +32,20 @@ class TestParseMapKey:
     def test_invalid_map_line(self):
         assert parse_map_key("map key") is None
         assert parse_map_key("map foo 58 CTRL") is None
+        assert parse_map_key("map key 58 CTRL_LEFT extra") is None
+        assert parse_map_key("map key usage SHIFT_LEFT") is None
+
+    def test_surrounding_whitespace(self):
+        result = parse_map_key("  map  key 58\tCTRL_LEFT  ")
+        assert result == (False, "58", "CTRL_LEFT")
+
+    def test_line_endings(self):
+        assert parse_map_key("map key 58 CTRL_LEFT\n") == (False, "58", "CTRL_LEFT")
+        assert parse_map_key("map key 58 CTRL_LEFT\r\n") == (False, "58", "CTRL_LEFT")
+
+    def test_only_spaces_and_tabs_before_map(self):
+        # from_layout ignores such lines, so the parser must too
+        assert parse_map_key("\x0cmap key 1 ESCAPE") is None
 
 
 class TestFromLayout:
@@ -55,12 +72,61 @@ class TestFromLayout:
         # Same mapping shouldn't be added twice
         assert result.count("map key 58 CAPS_LOCK") == 1
 
+    def test_comments_out_conflict_after_existing_duplicate(self):
+        layout = "type OVERLAY\nmap key 58 CAPS_LOCK\nmap key 58 ESCAPE\n"
+        result = from_layout(layout, {"58": "CAPS_LOCK"})
+        assert result.count("map key 58 CAPS_LOCK") == 1
+        assert "# map key 58 ESCAPE" in result
+
     def test_multiple_mappings(self):
         layout = "type OVERLAY\n"
         result = from_layout(layout, {"58": "CTRL_LEFT", "29": "CAPS_LOCK"})
         assert "map key 58 CTRL_LEFT" in result
         assert "map key 29 CAPS_LOCK" in result
 
+    def test_layout_without_trailing_newline(self):
+        layout = "type OVERLAY\nmap key 1 ESCAPE"
+        result = from_layout(layout, {"58": "CTRL_LEFT"})
+        assert result.startswith("type OVERLAY\nmap key 1 ESCAPE\n")
+        assert result.endswith("map key 58 CTRL_LEFT\n")
+
+    def test_crlf_layout_with_conflict(self):
+        layout = "type OVERLAY\r\nmap key 58 CAPS_LOCK\r\nmap key 1 ESCAPE\r\n"
+        result = from_layout(layout, {"58": "CTRL_LEFT"})
+        assert result.startswith(
+            "type OVERLAY\r\n"
+            + MODIFICATIONS_COMMENT
+            + "# map key 58 CAPS_LOCK\r\n"
+            + "map key 1 ESCAPE\r\n"
+        )
+        assert result.endswith("map key 58 CTRL_LEFT\n")
+
+    def test_indented_conflicting_mapping(self):
+        layout = "type OVERLAY\n  \tmap key 58 CAPS_LOCK\n"
+        result = from_layout(layout, {"58": "CTRL_LEFT"})
+        assert "\n# Custom key mappings:\n#   \tmap key 58 CAPS_LOCK\n" in result
+        assert result.endswith("map key 58 CTRL_LEFT\n")
+
+    def test_conflicting_usage_mapping(self):
+        layout = "type OVERLAY\nmap key usage 0x0007002a SHIFT_LEFT\nmap key 42 SHIFT_LEFT\n"
+        result = from_layout(layout, {"usage 0x0007002a": "CTRL_LEFT"})
+        assert "\n# map key usage 0x0007002a SHIFT_LEFT\n" in result
+        # The plain keycode mapping with the same number is untouched
+        assert "\nmap key 42 SHIFT_LEFT\n" in result
+        assert result.endswith("map key usage 0x0007002a CTRL_LEFT\n")
+
+    def test_existing_usage_mapping_not_duplicated(self):
+        layout = "type OVERLAY\nmap key usage 0x0007002a SHIFT_LEFT\n"
+        result = from_layout(layout, {"usage 0x0007002a": "SHIFT_LEFT"})
+        assert result == layout
+
+    def test_map_text_that_is_not_a_mapping(self):
+        layout = "type OVERLAY\n# keymap for map key 58\nmap key 58 CAPS_LOCK # note\n"
+        result = from_layout(layout, {"58": "CTRL_LEFT"})
+        assert result.startswith(layout)
+        assert "# #" not in result
+        assert result.endswith("map key 58 CTRL_LEFT\n")
+
 
 class TestFromNamedLayout:
     def test_with_no_base_layout(self):
@@ -77,6 +143,31 @@ class TestFromNamedLayout:
         assert "map key 58 CTRL_LEFT" in result
 
 
+class TestReadLayout:
+    def test_reads_named_layout(self):
+        layout = read_layout("keyboard_layout_german.kcm")
+        assert "map key" in layout
+
+    def test_repeat_reads_are_cached(self):
+        first = read_layout("keyboard_layout_german.kcm")
+        assert read_layout("keyboard_layout_german.kcm") is first
+
+    def test_modified_layout_is_reread(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("keylay.layouts.RESOURCES_DIR", tmp_path)
+        (tmp_path / "kcm").mkdir()
+        path = tmp_path / "kcm" / "custom.kcm"
+        path.write_text("type OVERLAY\n")
+        assert read_layout("custom.kcm") == "type OVERLAY\n"
+
+        path.write_text("type FULL\n")
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000_000))
+        assert read_layout("custom.kcm") == "type FULL\n"
+
+    def test_missing_layout(self):
+        assert read_layout("nonexistent.kcm") is None
+        assert read_layout("") is None
+
+
 class TestPathTraversal:
     """Test that path traversal attacks are blocked."""
 
@@ -92,6 +183,12 @@ class TestPathTraversal:
         with pytest.raises(ValueError, match="Invalid layout name"):
             get_kcm_path("..\\keylay_key.pem")
 
+    def test_rejects_non_kcm_name(self):
+        with pytest.raises(ValueError, match="Invalid layout name"):
+            get_kcm_path("keylay_key.pem")
+        with pytest.raises(ValueError, match="Invalid layout name"):
+            get_kcm_path(".kcm")
+
     def test_accepts_valid_filename(self):
         # Should not raise
         path = get_kcm_path("keyboard_layout_german.kcm")
@@ -9,12 +9,29 @@ from keylay.apk_builder import create_builder_from_env
 from keylay.server import create_app
 
 
+def read_kcms(response) -> dict[str, str]:
+    """Parse an APK response once and return its KCM files by path."""
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+        return {
+            name: zf.read(name).decode("utf-8") for name in zf.namelist() if name.endswith(".kcm")
+        }
+
+
+@pytest.fixture(scope="session")
+def builder():
+    """Create the builder once; loading keys and templates is the slow part."""
+    return create_builder_from_env()
+
+
+@pytest.fixture(scope="session")
+def app(builder):
+    """Create the app once, sharing the session builder."""
+    return create_app(builder, testing=True)
+
+
 @pytest.fixture
-def client():
+def client(app):
     """Create a test client."""
-    builder = create_builder_from_env()
-    app = create_app(builder)
-    app.config["TESTING"] = True
     with app.test_client() as client:
         yield client
 
@@ -34,6 +51,12 @@ class TestRoutes:
         assert response.status_code == 200
         assert b"html" in response.data.lower()
 
+    def test_security_headers(self, client):
+        response = client.get("/simple.html")
+        assert response.headers["X-Frame-Options"] == "DENY"
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+        assert response.headers["Referrer-Policy"] == "strict-origin-when-cross-origin"
+
 
 class TestApkGeneration:
     def test_simple_form_builds_apk(self, client):
@@ -47,6 +70,10 @@ class TestApkGeneration:
         )
         assert response.status_code == 200
         assert response.content_type == "application/vnd.android.package-archive"
+        assert response.headers["Content-Disposition"] == (
+            'attachment; filename="KeyboardLayout.apk"'
+        )
+        assert response.content_length == len(response.data)
 
         # Verify it's a valid APK
         with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
@@ -82,9 +109,8 @@ class TestApkGeneration:
         assert response.status_code == 200
         assert response.content_type == "application/vnd.android.package-archive"
 
-        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
-            kcm = zf.read("res/Q2.kcm").decode("utf-8")
-            assert "map key 58 ESCAPE" in kcm
+        kcm = read_kcms(response)["res/Q2.kcm"]
+        assert "map key 58 ESCAPE" in kcm
 
     def test_simple_form_multiple_mappings(self, client):
         """Test multiple key mappings are all included."""
@@ -101,10 +127,9 @@ class TestApkGeneration:
         )
         assert response.status_code == 200
 
-        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
-            kcm = zf.read("res/Q2.kcm").decode("utf-8")
-            assert "map key 58 ESCAPE" in kcm
-            assert "map key 1 CAPS_LOCK" in kcm
+        kcm = read_kcms(response)["res/Q2.kcm"]
+        assert "map key 58 ESCAPE" in kcm
+        assert "map key 1 CAPS_LOCK" in kcm
 
     def test_simple_form_with_second_layout(self, client):
         """Test that selecting a second layout produces a two-layout APK."""
@@ -119,15 +144,11 @@ class TestApkGeneration:
         )
         assert response.status_code == 200
 
-        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
-            # Two-layout APK should have both Q2.kcm and _f.kcm
-            assert "res/Q2.kcm" in zf.namelist()
-            assert "res/_f.kcm" in zf.namelist()
-
-            kcm1 = zf.read("res/Q2.kcm").decode("utf-8")
-            kcm2 = zf.read("res/_f.kcm").decode("utf-8")
-            assert "map key 58 ESCAPE" in kcm1
-            assert "map key 58 ESCAPE" in kcm2
+        # Two-layout APK should have both Q2.kcm and _f.kcm
+        kcms = read_kcms(response)
+        assert set(kcms) == {"res/Q2.kcm", "res/_f.kcm"}
+        assert "map key 58 ESCAPE" in kcms["res/Q2.kcm"]
+        assert "map key 58 ESCAPE" in kcms["res/_f.kcm"]
 
     def test_simple_form_empty_mapping_ignored(self, client):
         """Test that empty from/to values are ignored."""
@@ -144,8 +165,40 @@ class TestApkGeneration:
         )
         assert response.status_code == 200
 
-        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
-            kcm = zf.read("res/Q2.kcm").decode("utf-8")
-            assert "map key 58 ESCAPE" in kcm
-            # CTRL_LEFT should NOT appear since from2 was empty
-            assert "CTRL_LEFT" not in kcm
+        kcm = read_kcms(response)["res/Q2.kcm"]
+        assert "map key 58 ESCAPE" in kcm
+        # CTRL_LEFT should NOT appear since from2 was empty
+        assert "CTRL_LEFT" not in kcm
+
+    def test_simple_form_empty_target_ignored(self, client):
+        """Test that a mapping without a target key is ignored."""
+        response = client.post(
+            "/simple",
+            data={
+                "layout": "",
+                "layout2": "-",
+                "from1": "58",
+                "to1": "ESCAPE",
+                "from2": "1",
+                "to2": "",  # Empty - should be ignored
+            },
+        )
+        assert response.status_code == 200
+
+        kcm = read_kcms(response)["res/Q2.kcm"]
+        assert "map key 58 ESCAPE" in kcm
+        assert "map key 1 " not in kcm
+
+    def test_identical_requests_reuse_built_apk(self, client, builder):
+        """Repeat submissions are served from the builder's APK cache."""
+        data = {"layout": "", "layout2": "-", "from1": "58", "to1": "ESCAPE"}
+        before = builder._build_cached.cache_info()
+        first = client.post("/simple", data=data)
+        second = client.post("/simple", data=data)
+        after = builder._build_cached.cache_info()
+
+        assert first.status_code == second.status_code == 200
+        assert first.data == second.data
+        # At most one real build; the second request must hit the cache
+        assert after.misses - before.misses <= 1
+        assert after.hits - before.hits >= 1